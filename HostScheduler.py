@@ -0,0 +1,162 @@
+#   Copyright 2025 hidenorly
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import collections
+import random
+import threading
+import time
+
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+
+# per host token bucket rate limit, retry backoff and circuit breaker
+class HostScheduler:
+    def __init__(self, rate=0, burst=1, retries=2, backoff=1.0, maxBackoff=30.0, failureThreshold=5, coolDown=60.0, timeout=30.0, maxHosts=1000):
+        # rate : requests per second per host. 0 means unlimited
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.retries = retries
+        self.backoff = backoff
+        self.maxBackoff = maxBackoff
+        # failureThreshold : consecutive failures to open the circuit. 0 means never
+        self.failureThreshold = failureThreshold
+        self.coolDown = coolDown
+        # timeout : per request timeout [sec]. a timeout is a retryable failure
+        self.timeout = timeout
+        # host -> state. the least recently used host is evicted over maxHosts (e.g. long running service)
+        self.hosts = collections.OrderedDict()
+        self.maxHosts = maxHosts
+        self.lock = threading.Lock()
+
+    def getHost(self, url):
+        return urlparse(url).netloc
+
+    def _getState(self, host):
+        state = self.hosts.get(host)
+        if state:
+            self.hosts.move_to_end(host)
+        else:
+            state = {
+                "tokens": self.burst,
+                "last": time.time(),
+                "failures": 0,
+                "openUntil": 0,
+                # time when the probe was let through in the half-open state. 0 if no probe is in flight
+                "probeStarted": 0,
+            }
+            self.hosts[host] = state
+            if self.maxHosts and len(self.hosts) > self.maxHosts:
+                self.hosts.popitem(last=False)
+        return state
+
+    # wait for a token of the url's host and return the waited time [sec]
+    def acquire(self, url):
+        waitTime = 0
+        with self.lock:
+            state = self._getState(self.getHost(url))
+            if self.rate > 0:
+                now = time.time()
+                state["tokens"] = min(self.burst, state["tokens"] + (now - state["last"]) * self.rate)
+                state["last"] = now
+                # reserve the token even if it's not available yet
+                state["tokens"] = state["tokens"] - 1
+                if state["tokens"] < 0:
+                    waitTime = -state["tokens"] / self.rate
+        if waitTime:
+            time.sleep(waitTime)
+        return waitTime
+
+    # False while the circuit of the url's host is open
+    # After the coolDown, it's half-open and only one probe is let through.
+    # The probe's result closes the circuit or reopens it. (the probe expires after the coolDown)
+    def isAllowed(self, url):
+        with self.lock:
+            state = self._getState(self.getHost(url))
+            now = time.time()
+            if not state["openUntil"]:
+                return True
+            if now < state["openUntil"]:
+                return False
+            if state["probeStarted"] and now < state["probeStarted"] + self.coolDown:
+                return False
+            state["probeStarted"] = now
+            return True
+
+    # True while the circuit is open or half-open. this doesn't let the probe through
+    def isOpen(self, url):
+        return self.isHostOpen(self.getHost(url))
+
+    def isHostOpen(self, host):
+        with self.lock:
+            state = self._getState(host)
+            return bool(state["openUntil"])
+
+    def recordSuccess(self, url):
+        with self.lock:
+            state = self._getState(self.getHost(url))
+            state["failures"] = 0
+            state["openUntil"] = 0
+            state["probeStarted"] = 0
+
+    # the host responded but the probe url failed (e.g. 404). let the next probe through without changing the circuit
+    def releaseProbe(self, url):
+        with self.lock:
+            state = self._getState(self.getHost(url))
+            state["probeStarted"] = 0
+
+    # return True if this failure opened the circuit
+    def recordFailure(self, url):
+        with self.lock:
+            state = self._getState(self.getHost(url))
+            now = time.time()
+            if state["openUntil"]:
+                # the probe failed in the half-open state
+                if now >= state["openUntil"]:
+                    state["openUntil"] = now + self.coolDown
+                    state["probeStarted"] = 0
+                    return True
+                return False
+            state["failures"] = state["failures"] + 1
+            if self.failureThreshold and state["failures"] >= self.failureThreshold:
+                state["openUntil"] = now + self.coolDown
+                state["failures"] = 0
+                return True
+            return False
+
+    # exponential backoff with full jitter
+    def getBackoff(self, attempt):
+        return random.uniform(0, min(self.maxBackoff, self.backoff * (2 ** attempt)))
+
+    # Retry-After (seconds or HTTP-date) if it's given, otherwise the backoff. capped at maxBackoff
+    def getRetryDelay(self, attempt, retryAfter=None):
+        if retryAfter:
+            delay = None
+            try:
+                delay = float(retryAfter)
+            except ValueError:
+                try:
+                    delay = parsedate_to_datetime(retryAfter).timestamp() - time.time()
+                except (TypeError, ValueError):
+                    pass
+            if delay != None:
+                return min(max(delay, 0), self.maxBackoff)
+        return self.getBackoff(attempt)
+
+    def isRetryableStatus(self, statusCode):
+        return statusCode == 429 or statusCode >= 500
+
+    # the failures the circuit breaker counts: 429, 5xx and connection errors/timeouts (statusCode is None)
+    # a definite 4xx such as 403 or 404 is the failure of the url, not of the host
+    def isHostFailure(self, statusCode):
+        return statusCode == None or self.isRetryableStatus(statusCode)
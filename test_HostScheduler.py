@@ -0,0 +1,176 @@
+#   Copyright 2025 hidenorly
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import unittest
+from email.utils import formatdate
+from unittest import mock
+
+from HostScheduler import HostScheduler
+
+URL = "http://hoge.com/a.png"
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+    def sleep(self, sec):
+        self.now = self.now + sec
+
+
+class HostSchedulerTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        patcher = mock.patch("HostScheduler.time", self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_acquire_unlimited(self):
+        scheduler = HostScheduler(rate=0)
+        for i in range(10):
+            self.assertEqual(scheduler.acquire(URL), 0)
+
+    def test_acquire_token_bucket(self):
+        scheduler = HostScheduler(rate=2, burst=2)
+        # burst
+        self.assertEqual(scheduler.acquire(URL), 0)
+        self.assertEqual(scheduler.acquire(URL), 0)
+        # then 1 / rate per request
+        self.assertAlmostEqual(scheduler.acquire(URL), 0.5)
+        self.assertAlmostEqual(scheduler.acquire(URL), 0.5)
+        # the other host has own bucket
+        self.assertEqual(scheduler.acquire("http://other.com/a.png"), 0)
+        # refilled while idle
+        self.clock.sleep(10)
+        self.assertEqual(scheduler.acquire(URL), 0)
+        self.assertEqual(scheduler.acquire(URL), 0)
+        self.assertAlmostEqual(scheduler.acquire(URL), 0.5)
+
+    def test_circuit_opens_after_threshold(self):
+        scheduler = HostScheduler(failureThreshold=3, coolDown=60)
+        self.assertFalse(scheduler.recordFailure(URL))
+        self.assertFalse(scheduler.recordFailure(URL))
+        self.assertTrue(scheduler.isAllowed(URL))
+        self.assertTrue(scheduler.recordFailure(URL))
+        self.assertFalse(scheduler.isAllowed(URL))
+        self.assertTrue(scheduler.isOpen(URL))
+        self.assertTrue(scheduler.isAllowed("http://other.com/a.png"))
+
+    def test_success_resets_consecutive_failures(self):
+        scheduler = HostScheduler(failureThreshold=3)
+        scheduler.recordFailure(URL)
+        scheduler.recordFailure(URL)
+        scheduler.recordSuccess(URL)
+        self.assertFalse(scheduler.recordFailure(URL))
+        self.assertFalse(scheduler.recordFailure(URL))
+        self.assertTrue(scheduler.isAllowed(URL))
+
+    def test_never_opens_with_zero_threshold(self):
+        scheduler = HostScheduler(failureThreshold=0)
+        for i in range(100):
+            self.assertFalse(scheduler.recordFailure(URL))
+        self.assertTrue(scheduler.isAllowed(URL))
+
+    def openCircuit(self, scheduler):
+        while not scheduler.recordFailure(URL):
+            pass
+
+    def test_half_open_lets_one_probe_through(self):
+        scheduler = HostScheduler(failureThreshold=3, coolDown=60)
+        self.openCircuit(scheduler)
+        self.clock.sleep(60)
+        # isOpen doesn't take the probe
+        self.assertTrue(scheduler.isOpen(URL))
+        self.assertTrue(scheduler.isAllowed(URL))
+        self.assertFalse(scheduler.isAllowed(URL))
+
+    def test_half_open_probe_failure_reopens(self):
+        scheduler = HostScheduler(failureThreshold=3, coolDown=60)
+        self.openCircuit(scheduler)
+        self.clock.sleep(60)
+        self.assertTrue(scheduler.isAllowed(URL))
+        # the first failure reopens it without waiting for the threshold
+        self.assertTrue(scheduler.recordFailure(URL))
+        self.assertFalse(scheduler.isAllowed(URL))
+        self.clock.sleep(59)
+        self.assertFalse(scheduler.isAllowed(URL))
+
+    def test_half_open_probe_success_closes(self):
+        scheduler = HostScheduler(failureThreshold=3, coolDown=60)
+        self.openCircuit(scheduler)
+        self.clock.sleep(60)
+        self.assertTrue(scheduler.isAllowed(URL))
+        scheduler.recordSuccess(URL)
+        self.assertFalse(scheduler.isOpen(URL))
+        self.assertTrue(scheduler.isAllowed(URL))
+        self.assertTrue(scheduler.isAllowed(URL))
+
+    def test_half_open_probe_expires(self):
+        scheduler = HostScheduler(failureThreshold=3, coolDown=60)
+        self.openCircuit(scheduler)
+        self.clock.sleep(60)
+        self.assertTrue(scheduler.isAllowed(URL))
+        # the probe's result never comes
+        self.clock.sleep(59)
+        self.assertFalse(scheduler.isAllowed(URL))
+        self.clock.sleep(1)
+        self.assertTrue(scheduler.isAllowed(URL))
+
+    def test_release_probe_keeps_circuit(self):
+        scheduler = HostScheduler(failureThreshold=3, coolDown=60)
+        self.openCircuit(scheduler)
+        self.clock.sleep(60)
+        self.assertTrue(scheduler.isAllowed(URL))
+        # e.g. 404 of the probe url
+        scheduler.releaseProbe(URL)
+        self.assertTrue(scheduler.isOpen(URL))
+        self.assertTrue(scheduler.isAllowed(URL))
+
+    def test_host_failure_status(self):
+        scheduler = HostScheduler()
+        # connection error / timeout
+        self.assertTrue(scheduler.isHostFailure(None))
+        for statusCode in [429, 500, 502, 503, 504]:
+            self.assertTrue(scheduler.isHostFailure(statusCode), statusCode)
+            self.assertTrue(scheduler.isRetryableStatus(statusCode), statusCode)
+        for statusCode in [400, 401, 403, 404, 410]:
+            self.assertFalse(scheduler.isHostFailure(statusCode), statusCode)
+            self.assertFalse(scheduler.isRetryableStatus(statusCode), statusCode)
+
+    def test_retry_delay(self):
+        scheduler = HostScheduler(backoff=1.0, maxBackoff=30.0)
+        self.assertEqual(scheduler.getRetryDelay(0, "5"), 5)
+        self.assertEqual(scheduler.getRetryDelay(0, "120"), 30)
+        self.assertEqual(scheduler.getRetryDelay(0, formatdate(self.clock.now + 10, usegmt=True)), 10)
+        self.assertEqual(scheduler.getRetryDelay(0, formatdate(self.clock.now - 10, usegmt=True)), 0)
+        for attempt in range(5):
+            delay = scheduler.getRetryDelay(attempt, "invalid")
+            self.assertTrue(0 <= delay <= min(30.0, 2 ** attempt))
+            delay = scheduler.getRetryDelay(attempt)
+            self.assertTrue(0 <= delay <= min(30.0, 2 ** attempt))
+
+    def test_hosts_are_bounded(self):
+        scheduler = HostScheduler(maxHosts=2)
+        scheduler.acquire("http://a.com/")
+        scheduler.acquire("http://b.com/")
+        scheduler.acquire("http://a.com/")
+        scheduler.acquire("http://c.com/")
+        self.assertEqual(list(scheduler.hosts.keys()), ["a.com", "c.com"])
+
+
+if __name__ == '__main__':
+    unittest.main()
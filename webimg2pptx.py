@@ -13,15 +13,23 @@
 #   limitations under the License.
 
 import argparse
+import base64
+import collections
 import os
 import re
 import random
 import requests
 import string
+import threading
 import time
 
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures import wait as waitFutures
 from ImageUtil import ImageUtil
+from HostScheduler import HostScheduler
 
+import urllib.error
 import urllib.request
 from urllib.parse import urljoin
 from urllib.parse import urlparse
@@ -29,6 +37,7 @@ from selenium import webdriver
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
+from selenium.common.exceptions import TimeoutException
 
 from pptx import Presentation
 from pptx.util import Inches, Pt
@@ -40,9 +49,13 @@ from pptx.dml.color import RGBColor
 
 import webcolors
 
-globalCache = {}
-
 class UrlUtil:
+    HEAD_TIMEOUT = 30
+    # url -> extension resolved via HEAD request. shared across runs (e.g. service mode) and bounded as LRU
+    extCache = collections.OrderedDict()
+    extCacheLock = threading.Lock()
+    EXT_CACHE_SIZE = 10000
+
     def isSameDomain(url1, url2, baseUrl=""):
         isSame = urlparse(url1).netloc == urlparse(url2).netloc
         isbaseUrl =  ( (baseUrl=="") or url2.startswith(baseUrl) )
@@ -85,18 +98,39 @@ class UrlUtil:
 
         # fallback if url doesn't contain the file extension
         if not ext:
-            try:
-                response = requests.head(url)
-                content_type = response.headers.get('Content-Type')
-                ext = UrlUtil.get_extension_from_mime(content_type)
-            except:
-                pass
+            with UrlUtil.extCacheLock:
+                ext = UrlUtil.extCache.get(url, "")
+                if ext:
+                    UrlUtil.extCache.move_to_end(url)
+            if not ext:
+                try:
+                    response = requests.head(url, timeout=UrlUtil.HEAD_TIMEOUT)
+                    content_type = response.headers.get('Content-Type')
+                    ext = UrlUtil.get_extension_from_mime(content_type)
+                    if ext:
+                        with UrlUtil.extCacheLock:
+                            UrlUtil.extCache[url] = ext
+                            if len(UrlUtil.extCache) > UrlUtil.EXT_CACHE_SIZE:
+                                UrlUtil.extCache.popitem(last=False)
+                except:
+                    pass
 
         return str(ext)
 
     def isValidUrl(url):
         return str(url).startswith("http")
 
+    def getByRequests(url, timeout=None):
+        response = requests.get(url, timeout=timeout)
+        return response, response.status_code, response.headers
+
+    def getByUrllib(url, timeout=None):
+        try:
+            with urllib.request.urlopen(url, timeout=timeout) as response:
+                return response.read(), response.status, response.headers
+        except urllib.error.HTTPError as e:
+            return None, e.code, e.headers
+
 
 class WebPageImageDownloader:
     def __init__(self, width=1920, height=1080):
@@ -114,8 +148,94 @@ class WebPageImageDownloader:
         driver.set_window_size(width, height)
         self.driver = driver
         self._driver = tempDriver
+        self.options = options
+        self.width = width
+        self.height = height
+        # fallback mode is element, navigate or none
+        self.fallbackMode = "element"
+        # secondary browser to capture the failed images from the rendered page. created when necessary
+        self.fallbackDriver = None
+        self.fallbackExecutor = None
+        self.fallbackFutures = []
+        # set to stop the captures of the run. created per run so that a run never stops the next one
+        self.captureStop = threading.Event()
+        # time out [sec] to wait for an image on the page to finish loading
+        self.captureTimeOut = 5
+        self.cache = {}
+        self.stats = {}
+        self.statsLock = threading.Lock()
+        # host:{requests, errors, trips} of this run. the hostScheduler may be shared with other runs
+        self.hostStats = {}
+        self.hostScheduler = HostScheduler()
+        # imageUrl:pageUrl of the images whose host's circuit was open
+        self.deferredUrls = {}
+        # per run limits. 0 means unlimited
+        self.maxImages = 0
+        self.deadline = 0
+
+    def resetRun(self, maxImages=0, maxTime=0):
+        self.cache = {}
+        self.deferredUrls = {}
+        self.fallbackFutures = []
+        self.captureStop = threading.Event()
+        self.hostStats = {}
+        self.stats = {
+            "pages": 0,
+            "images": 0,
+            "downloaded": 0,
+            "fallbacks": 0,
+            "captured": 0,
+            "failed": 0,
+            "retries": 0,
+            "throttled": 0,
+            "deferred": 0,
+            "skipped": 0,
+            "limited": False,
+        }
+        self.maxImages = maxImages
+        self.deadline = time.time() + maxTime if maxTime else 0
+
+    def countStat(self, key, value=1):
+        with self.statsLock:
+            self.stats[key] = round(self.stats.get(key, 0) + value, 2)
+
+    def countHostStat(self, url, key):
+        host = self.hostScheduler.getHost(url)
+        with self.statsLock:
+            if not host in self.hostStats:
+                self.hostStats[host] = {"requests": 0, "errors": 0, "trips": 0}
+            self.hostStats[host][key] = self.hostStats[host][key] + 1
+
+    # the hosts which had errors in this run
+    def getHostStats(self):
+        result = {}
+        with self.statsLock:
+            for host, hostStat in self.hostStats.items():
+                if hostStat["errors"] or hostStat["trips"]:
+                    result[host] = dict(hostStat)
+        for host in result.keys():
+            result[host]["open"] = self.hostScheduler.isHostOpen(host)
+        return result
+
+    def isLimitReached(self):
+        if self.maxImages and self.stats.get("downloaded", 0) >= self.maxImages:
+            self.stats["limited"] = True
+            return True
+        if self.deadline and time.time() >= self.deadline:
+            self.stats["limited"] = True
+            return True
+        return False
 
     def close(self):
+            if self.fallbackExecutor:
+                self.fallbackExecutor.shutdown(wait=True)
+                self.fallbackExecutor = None
+            if self.fallbackDriver:
+                try:
+                    self.fallbackDriver.quit()
+                except:
+                    pass
+                self.fallbackDriver = None
             if self.driver:
                 try:
                     self.driver.close()
@@ -163,24 +283,71 @@ class WebPageImageDownloader:
         filename = os.path.basename(filename)
         return f, filename, filePath
 
+    def throttle(self, url):
+        self.countHostStat(url, "requests")
+        waitTime = self.hostScheduler.acquire(url)
+        if waitTime:
+            self.countStat("throttled", waitTime)
+
+    # requestFunc(url, timeout) returns (result, statusCode, headers). Return the result if it's 200 within the retry budget
+    # exceptions including timeout are retryable
+    def requestWithRetry(self, url, requestFunc):
+        retryDelay = 0
+        for attempt in range(self.hostScheduler.retries + 1):
+            if attempt:
+                self.countStat("retries")
+                time.sleep(retryDelay)
+            self.throttle(url)
+            result = None
+            statusCode = None
+            headers = None
+            try:
+                result, statusCode, headers = requestFunc(url, self.hostScheduler.timeout)
+            except:
+                pass
+            if statusCode == 200:
+                self.hostScheduler.recordSuccess(url)
+                return result
+            if not self.hostScheduler.isHostFailure(statusCode):
+                # e.g. 403, 404. leave it to the fallback without affecting the host's circuit
+                self.hostScheduler.releaseProbe(url)
+                return None
+            if self.hostScheduler.isOpen(url):
+                break
+            retryDelay = self.hostScheduler.getRetryDelay(attempt, headers.get("Retry-After") if headers else None)
+        self.countHostStat(url, "errors")
+        if self.hostScheduler.recordFailure(url):
+            self.countHostStat(url, "trips")
+        return None
+
+    def getFallbackUrl(self, imageUrl, withFullArgUrl=False):
+        if not withFullArgUrl:
+            pos = imageUrl.find("?")
+            if pos!=-1:
+                imageUrl = imageUrl[0:pos]
+        return imageUrl
+
+    def getFallbackFilePath(self, outputPath, imageUrl):
+        _filename = UrlUtil.getFilenameFromUrl(imageUrl)+".png"
+        filePath=os.path.join(outputPath, _filename)
+        if os.path.exists(filePath):
+            _filename = self.getRandomFilename()+".png"
+            filePath=os.path.join(outputPath, _filename)
+        return _filename, filePath
+
     def fallbackDownloadImage(self, imageUrl, outputPath, withFullArgUrl=False):
         filePath = None
         filename = None
         url = None
+        driver = self.driver
 
         try:
-            if not withFullArgUrl:
-                pos = imageUrl.find("?")
-                if pos!=-1:
-                    imageUrl = imageUrl[0:pos]
+            imageUrl = self.getFallbackUrl(imageUrl, withFullArgUrl)
             if UrlUtil.isValidUrl(imageUrl):
-                self.driver.get(imageUrl)
-                _filename = UrlUtil.getFilenameFromUrl(imageUrl)+".png"
-                filePath=os.path.join(outputPath, _filename)
-                if os.path.exists(filePath):
-                    _filename = self.getRandomFilename()+".png"
-                    filePath=os.path.join(outputPath, _filename)
-                self.driver.save_screenshot(filePath)
+                self.throttle(imageUrl)
+                driver.get(imageUrl)
+                _filename, filePath = self.getFallbackFilePath(outputPath, imageUrl)
+                driver.save_screenshot(filePath)
                 if os.path.exists(filePath):
                     url = imageUrl
                     filename = _filename
@@ -191,30 +358,218 @@ class WebPageImageDownloader:
         return filename, url, filePath
 
 
-    def downloadImage(self, imageUrl, outputPath, minDownloadSize=None, withFullArgUrl=False):
+    # skip the fallback while the host's circuit is open instead of screenshotting every url
+    # if fallbackUrls is given, the image is appended to it to capture later from the rendered page
+    def fallbackDownloadImageIfAllowed(self, imageUrl, outputPath, withFullArgUrl=False, fallbackUrls=None):
+        if self.hostScheduler.isOpen(imageUrl):
+            self.countStat("skipped")
+            return None, None, None
+        if self.fallbackMode == "none":
+            self.countStat("failed")
+            return None, None, None
+        if fallbackUrls != None and self.fallbackMode == "element":
+            fallbackUrls.append(imageUrl)
+            return None, None, None
+        self.countStat("fallbacks")
+        filename, url, filePath = self.fallbackDownloadImage(imageUrl, outputPath, withFullArgUrl)
+        if not filename or not url:
+            self.countStat("failed")
+        return filename, url, filePath
+
+
+    def getFallbackDriver(self):
+        if not self.fallbackDriver:
+            self.fallbackDriver = webdriver.Chrome(options=self.options)
+            self.fallbackDriver.set_window_size(self.width, self.height)
+        return self.fallbackDriver
+
+    def findImageElement(self, driver, imageUrl):
+        return driver.execute_script("""
+            const url = arguments[0];
+            for (const img of document.images) {
+                if (img.currentSrc === url || img.src === url) {
+                    return img;
+                }
+            }
+            return null;
+        """, imageUrl)
+
+    # export the image at its natural size via canvas. null if the canvas is tainted by cross origin image
+    def getImageDataUrl(self, driver, element):
+        return driver.execute_script("""
+            const img = arguments[0];
+            try {
+                const canvas = document.createElement('canvas');
+                canvas.width = img.naturalWidth;
+                canvas.height = img.naturalHeight;
+                canvas.getContext('2d').drawImage(img, 0, 0);
+                return canvas.toDataURL('image/png');
+            } catch (e) {
+                return null;
+            }
+        """, element)
+
+    # take the element screenshot after resizing the element to its natural size (within the window)
+    def captureImageElement(self, driver, element, filePath, size):
+        width, height = size
+        ratio = min(1.0, self.width / width, self.height / height)
+        prevStyle = driver.execute_script("""
+            const img = arguments[0];
+            const prevStyle = img.getAttribute('style');
+            for (const [key, value] of [['width', arguments[1]+'px'], ['height', arguments[2]+'px'],
+                    ['max-width', 'none'], ['max-height', 'none'], ['object-fit', 'fill'], ['transform', 'none']]) {
+                img.style.setProperty(key, value, 'important');
+            }
+            img.scrollIntoView({block: 'center', inline: 'center'});
+            return prevStyle;
+        """, element, int(width * ratio), int(height * ratio))
+        try:
+            element.screenshot(filePath)
+        finally:
+            driver.execute_script("""
+                const img = arguments[0];
+                if (arguments[1] === null) {
+                    img.removeAttribute('style');
+                } else {
+                    img.setAttribute('style', arguments[1]);
+                }
+            """, element, prevStyle)
+
+    # capture the failed images of pageUrl from the page rendered on the secondary browser
+    # return [(imageUrl, filename, url, status)]
+    # status is captured, small (less than minDownloadSize), broken (failed to load on the page too),
+    # missing (not found or still loading on the page) or limited (maxImages or maxTime is reached, or stopEvent is set)
+    def captureImagesFromPage(self, pageUrl, imageUrls, outputPath, minDownloadSize=None, withFullArgUrl=False, timeOut=60, stopEvent=None):
+        results = []
+        driver = None
+        if stopEvent and stopEvent.is_set():
+            return [(imageUrl, None, None, "limited") for imageUrl in imageUrls]
+        try:
+            driver = self.getFallbackDriver()
+            driver.set_page_load_timeout(timeOut)
+            self.throttle(pageUrl)
+            driver.get(pageUrl)
+            driver.execute_script("window.scrollTo(0, document.body.scrollHeight)")
+        except Exception as e:
+            print(f"Error while processing {pageUrl}: {e}")
+            driver = None
+
+        for imageUrl in imageUrls:
+            filename = None
+            url = None
+            status = "missing"
+            if (stopEvent and stopEvent.is_set()) or self.isLimitReached():
+                status = "limited"
+            elif driver:
+                try:
+                    element = self.findImageElement(driver, imageUrl)
+                    if element:
+                        driver.execute_script("arguments[0].scrollIntoView({block: 'center'})", element)
+                        # a broken image is also complete with naturalWidth == 0
+                        isComplete = False
+                        try:
+                            WebDriverWait(driver, self.captureTimeOut).until(lambda d: d.execute_script("return arguments[0].complete", element))
+                            isComplete = True
+                        except TimeoutException:
+                            pass
+                        size = None
+                        if isComplete:
+                            size = driver.execute_script("return [arguments[0].naturalWidth, arguments[0].naturalHeight]", element)
+                        if not isComplete:
+                            # still loading. leave it to the navigation fallback
+                            status = "missing"
+                        elif not size or not size[0] or not size[1]:
+                            status = "broken"
+                        elif minDownloadSize!=None and (size[0] < minDownloadSize[0] or size[1] < minDownloadSize[1]):
+                            status = "small"
+                        else:
+                            # broken unless it's captured
+                            status = "broken"
+                            _filename, filePath = self.getFallbackFilePath(outputPath, imageUrl)
+                            dataUrl = self.getImageDataUrl(driver, element)
+                            if dataUrl and dataUrl.startswith("data:image/png;base64,"):
+                                with open(filePath, 'wb') as f:
+                                    f.write(base64.b64decode(dataUrl.split(",", 1)[1]))
+                            else:
+                                self.captureImageElement(driver, element, filePath, size)
+                            if os.path.exists(filePath):
+                                filename = _filename
+                                url = self.getFallbackUrl(imageUrl, withFullArgUrl)
+                                status = "captured"
+                except Exception as e:
+                    print(f"Error while capturing {imageUrl}: {e}")
+            results.append((imageUrl, filename, url, status))
+        return results
+
+    def captureImagesFromPageAsync(self, pageUrl, imageUrls, outputPath, minDownloadSize=None, withFullArgUrl=False, timeOut=60):
+        if not self.fallbackExecutor:
+            self.fallbackExecutor = ThreadPoolExecutor(max_workers=1)
+        self.countStat("fallbacks", len(imageUrls))
+        future = self.fallbackExecutor.submit(self.captureImagesFromPage, pageUrl, imageUrls, outputPath, minDownloadSize, withFullArgUrl, timeOut, self.captureStop)
+        self.fallbackFutures.append((pageUrl, future))
+
+    # stop the captures of this run and wait for the running one to finish its current image
+    # so that the downloader can be reused (e.g. by the next job in the service mode)
+    def stopCaptureImages(self):
+        self.captureStop.set()
+        futures = [future for pageUrl, future in self.fallbackFutures]
+        for future in futures:
+            future.cancel()
+        waitFutures(futures)
+        self.fallbackFutures = []
+
+    # wait for the captures and navigate to the images which couldn't be found on the page as the last resort
+    # the pending captures are cancelled once maxImages or maxTime is reached
+    def completeCaptureImages(self, fileUrls, outputPath, usePageUrl, withFullArgUrl=False):
+        for pageUrl, future in self.fallbackFutures:
+            results = []
+            if self.isLimitReached():
+                break
+            try:
+                timeout = max(self.deadline - time.time(), 0) if self.deadline else None
+                results = future.result(timeout)
+            except FutureTimeoutError:
+                self.stats["limited"] = True
+                break
+            except Exception as e:
+                print(f"Error while capturing images at {pageUrl}: {e}")
+            for imageUrl, fileName, url, status in results:
+                if self.isLimitReached():
+                    break
+                if status == "missing" and not self.hostScheduler.isOpen(imageUrl):
+                    fileName, url, filePath = self.fallbackDownloadImage(imageUrl, outputPath, withFullArgUrl)
+                if fileName and url:
+                    if status == "captured":
+                        self.countStat("captured")
+                    self.countStat("downloaded")
+                    self.addFileUrl(fileUrls, fileName, url, pageUrl, usePageUrl)
+                elif status == "missing" or status == "broken":
+                    self.countStat("failed")
+        self.stopCaptureImages()
+
+
+    def downloadImage(self, imageUrl, outputPath, minDownloadSize=None, withFullArgUrl=False, fallbackUrls=None):
         filename = None
         url = None
-        if UrlUtil.isValidUrl(imageUrl) and not imageUrl in globalCache:
-            globalCache[imageUrl] = True
+        if UrlUtil.isValidUrl(imageUrl) and not imageUrl in self.cache:
+            self.cache[imageUrl] = True
+            self.countStat("images")
             filePath = None
 
             ext = UrlUtil.getExtFromUrl(imageUrl)
             if ext.endswith((".heic", ".HEIC", ".svg", ".webp", ".avif")):
-                try:
-                    with urllib.request.urlopen(imageUrl) as response:
-                        imgContent = response.read()
-                        url =imageUrl
-                        f, filename, filePath = self.getOutputFileStream(outputPath, imageUrl)
-                        if f:
-                            f.write(imgContent)
-                            f.close()
-                except:
-                    pass
+                imgContent = self.requestWithRetry(imageUrl, UrlUtil.getByUrllib)
+                if imgContent:
+                    url =imageUrl
+                    f, filename, filePath = self.getOutputFileStream(outputPath, imageUrl)
+                    if f:
+                        f.write(imgContent)
+                        f.close()
 
                 if not filePath or not os.path.exists(filePath):
                     # fallback...
                     print(f'Failed to download {imageUrl}')
-                    _filename, _url, filePath = self.fallbackDownloadImage(imageUrl, outputPath, withFullArgUrl)
+                    _filename, _url, filePath = self.fallbackDownloadImageIfAllowed(imageUrl, outputPath, withFullArgUrl, fallbackUrls)
                     if _filename and _url:
                         filename = _filename
                         url = _url
@@ -241,13 +596,13 @@ class WebPageImageDownloader:
                 # .png, .jpeg, etc.
                 size = None
                 response = None
-                try:
-                    response = requests.get(imageUrl)
-                    if response.status_code == 200:
+                response = self.requestWithRetry(imageUrl, UrlUtil.getByRequests)
+                if response:
+                    try:
                         # check image size
                         size = ImageUtil.getImageSizeFromChunk(response.content)
-                except:
-                    print(f'failed to get image size at {imageUrl}')
+                    except:
+                        print(f'failed to get image size at {imageUrl}')
 
                 if response and response.status_code == 200:
                     if minDownloadSize==None or (size and size[0] >= minDownloadSize[0] and size[1] >= minDownloadSize[1]):
@@ -260,25 +615,38 @@ class WebPageImageDownloader:
                 else:
                     # fallback...
                     print(f'Failed to download {imageUrl}')
-                    _filename, _url, filePath = self.fallbackDownloadImage(imageUrl, outputPath, withFullArgUrl)
+                    _filename, _url, filePath = self.fallbackDownloadImageIfAllowed(imageUrl, outputPath, withFullArgUrl, fallbackUrls)
                     if _filename and _url:
                         filename = _filename
                         url = _url
 
+            if filename:
+                self.countStat("downloaded")
+
         return filename, url
 
 
+    def addFileUrl(self, fileUrls, fileName, url, pageUrl, usePageUrl):
+        if fileName and not fileName in fileUrls:
+            if usePageUrl:
+                fileUrls[fileName] = pageUrl
+            elif url:
+                fileUrls[fileName] = url
+
+
     def _downloadImagesFromWebPage(self, fileUrls, pageUrls, pageUrl, outputPath, minDownloadSize, baseUrl, maxDepth, depth, usePageUrl, timeOut, withFullArgUrl, scrollPauseTime = 2):
         driver = self.driver
         _imageUrls=[]
         _pageUrls=[]
 
-        if driver==None or depth > maxDepth:
+        if driver==None or depth > maxDepth or self.isLimitReached():
             return
 
-        if not pageUrl in globalCache:
-            #globalCache[pageUrl] = True
+        if not pageUrl in self.cache:
+            #self.cache[pageUrl] = True
             try:
+                self.countStat("pages")
+                self.throttle(pageUrl)
                 driver.get(pageUrl)
                 last_height = driver.execute_script("return document.body.scrollHeight")
 
@@ -325,26 +693,58 @@ class WebPageImageDownloader:
                 pass #print(f"Error while processing {pageUrl}: {e}")
 
 
+            fallbackUrls = []
             for imageUrl in _imageUrls:
-                fileName, url = self.downloadImage(imageUrl, outputPath, minDownloadSize, withFullArgUrl)
-                if fileName and not fileName in fileUrls:
-                    if usePageUrl:
-                        fileUrls[fileName] = pageUrl
-                    elif url:
-                        fileUrls[fileName] = url
+                if self.isLimitReached():
+                    break
+                if imageUrl in self.cache:
+                    continue
+                # isAllowed lets the probe through in the half-open state
+                if not self.hostScheduler.isAllowed(imageUrl):
+                    # defer until the host's circuit becomes half-open
+                    if not imageUrl in self.deferredUrls:
+                        self.deferredUrls[imageUrl] = pageUrl
+                        self.countStat("deferred")
+                    continue
+                fileName, url = self.downloadImage(imageUrl, outputPath, minDownloadSize, withFullArgUrl, fallbackUrls)
+                self.addFileUrl(fileUrls, fileName, url, pageUrl, usePageUrl)
+
+            # capture the failed images of this page on the secondary browser while crawling the next pages
+            if fallbackUrls:
+                self.captureImagesFromPageAsync(pageUrl, fallbackUrls, outputPath, minDownloadSize, withFullArgUrl, timeOut)
 
             for href in _pageUrls:
                 self._downloadImagesFromWebPage(fileUrls, pageUrls, href, outputPath, minDownloadSize, baseUrl, maxDepth, depth + 1, usePageUrl, timeOut, withFullArgUrl)
 
 
-    def downloadImagesFromWebPages(self, urls, outputPath, minDownloadSize=None, baseUrl="", maxDepth=1, usePageUrl=False, timeOut=60, withFullArgUrl=False):
+    def downloadImagesFromWebPages(self, urls, outputPath, minDownloadSize=None, baseUrl="", maxDepth=1, usePageUrl=False, timeOut=60, withFullArgUrl=False, maxImages=0, maxTime=0):
         fileUrls = {}
 
         driver = self.driver
+        self.resetRun(maxImages, maxTime)
 
         pageUrls=set()
-        for url in urls:
-            self._downloadImagesFromWebPage(fileUrls, pageUrls, url, outputPath, minDownloadSize, baseUrl, maxDepth, 0, usePageUrl, timeOut, withFullArgUrl)
+        try:
+            for url in urls:
+                self._downloadImagesFromWebPage(fileUrls, pageUrls, url, outputPath, minDownloadSize, baseUrl, maxDepth, 0, usePageUrl, timeOut, withFullArgUrl)
+
+            self.completeCaptureImages(fileUrls, outputPath, usePageUrl, withFullArgUrl)
+        finally:
+            # don't leave the captures running on the downloader even if the crawl failed
+            self.stopCaptureImages()
+
+        # retry the deferred images if their host's circuit is half-open now. otherwise skip them
+        for imageUrl, pageUrl in self.deferredUrls.items():
+            if self.isLimitReached():
+                break
+            if imageUrl in self.cache:
+                continue
+            if self.hostScheduler.isAllowed(imageUrl):
+                fileName, url = self.downloadImage(imageUrl, outputPath, minDownloadSize, withFullArgUrl)
+                self.addFileUrl(fileUrls, fileName, url, pageUrl, usePageUrl)
+            else:
+                self.countStat("skipped")
+        self.deferredUrls = {}
 
         return fileUrls
 
@@ -510,7 +910,23 @@ class PowerPointUtil:
 
 
 
-if __name__ == '__main__':
+
+
+def addHostSchedulerArgs(parser):
+    parser.add_argument('--hostRate', type=float, default=0, help='Specify maximum requests per second per host (0: unlimited)')
+    parser.add_argument('--hostBurst', type=int, default=1, help='Specify burst requests per host allowed over --hostRate')
+    parser.add_argument('--retries', type=int, default=2, help='Specify retry count for 429, 5xx and connection errors')
+    parser.add_argument('--retryBackoff', type=float, default=1.0, help='Specify base backoff [sec] between retries (exponential with jitter)')
+    parser.add_argument('--breakerThreshold', type=int, default=5, help='Specify consecutive failures per host to skip the host (0: never)')
+    parser.add_argument('--breakerCoolDown', type=float, default=60.0, help='Specify time [sec] to skip the host after --breakerThreshold failures')
+    parser.add_argument('--requestTimeOut', type=float, default=30.0, help='Specify time out [sec] per image request. time out is retried')
+
+
+def createHostScheduler(args):
+    return HostScheduler(args.hostRate, args.hostBurst, args.retries, args.retryBackoff, failureThreshold=args.breakerThreshold, coolDown=args.breakerCoolDown, timeout=args.requestTimeOut)
+
+
+def createArgParser():
     parser = argparse.ArgumentParser(description='Download images from web pages', formatter_class=argparse.ArgumentDefaultsHelpFormatter)
     parser.add_argument('pages', metavar='PAGE', type=str, nargs='+', help='Web pages to download images from')
     parser.add_argument('-t', '--temp', dest='tempPath', type=str, default='.', help='Temporary path.')
@@ -524,6 +940,11 @@ if __name__ == '__main__':
     parser.add_argument('--maxDepth', type=int, default=1, help='maximum depth of links to follow')
     parser.add_argument('--baseUrl', type=str, default="", help='Specify base url if you want to restrict download under the baseUrl')
     parser.add_argument('--timeOut', type=int, default=60, help='Specify time out [sec] if you want to change the default')
+    parser.add_argument('--maxImages', type=int, default=0, help='Specify maximum number of images to download (0: unlimited)')
+    parser.add_argument('--maxTime', type=int, default=0, help='Specify maximum time [sec] to spend on downloading (0: unlimited)')
+    parser.add_argument('--fallback', type=str, default='element', choices=['element', 'navigate', 'none'], help='Specify fallback for failed images. element: capture from the rendered page, navigate: screenshot the image url')
+    parser.add_argument('--captureTimeOut', type=float, default=5.0, help='Specify time out [sec] to wait for an image on the page in the element fallback')
+    addHostSchedulerArgs(parser)
     parser.add_argument('--offsetX', type=float, default=0, help='Specify offset x (Inch. max 16. float)')
     parser.add_argument('--offsetY', type=float, default=0, help='Specify offset y (Inch. max 9. float)')
     parser.add_argument('--fontFace', type=str, default="Calibri", help='Specify font face if necessary')
@@ -531,25 +952,13 @@ if __name__ == '__main__':
     parser.add_argument('--title', type=str, default=None, help='Specify title if necessary')
     parser.add_argument('--titleSize', type=float, default=None, help='Specify title size if necessary')
     parser.add_argument('--titleFormat', type=str, default=None, help='Specify title format if necessary e.g. color:black,face:游ゴシック,size:40,bold')
-    args = parser.parse_args()
-    if args.usePageUrl:
-        args.addUrl = True
-
-    # --- download 
-    minDownloadSize = None
-    if args.minSize:
-        minDownloadSize = tuple(map(int, args.minSize.split('x')))
-
-    if not os.path.exists(args.tempPath):
-        os.makedirs(args.tempPath)
+    return parser
 
-    downloader = WebPageImageDownloader()
-    fileUrls = downloader.downloadImagesFromWebPages(args.pages, args.tempPath, minDownloadSize, args.baseUrl, args.maxDepth, args.usePageUrl, args.timeOut, args.withFullArgUrl)
-    downloader.close()
-    downloader = None
 
+def createPresentation(args, fileUrls):
     # --- create power point
     prs = PowerPointUtil( args.output )
+    slides = 0
 
     # --- sort per page url
     perPageImgFiles={}
@@ -598,6 +1007,7 @@ if __name__ == '__main__':
             imagePath = os.path.join(args.tempPath, filename)
             if os.path.exists(imagePath):
                 prs.addSlide()
+                slides = slides + 1
                 pic = prs.addPicture(imagePath, x, y, None, None, True, regionWidth, regionHeight, isFitWihthinRegion)
                 # Add Title
                 if args.title:
@@ -615,3 +1025,71 @@ if __name__ == '__main__':
 
     # --- save the ppt file
     prs.save()
+
+    return slides
+
+
+# download the images with the parsed args and return the fileUrls and the download statistics
+# downloader is created and closed here unless it's given (e.g. warm downloader in the service mode)
+# hostScheduler is created from args unless it's given (e.g. shared between jobs in the service mode)
+def downloadImages(args, downloader=None, hostScheduler=None):
+    if args.usePageUrl:
+        args.addUrl = True
+
+    minDownloadSize = None
+    if args.minSize:
+        minDownloadSize = tuple(map(int, args.minSize.split('x')))
+
+    if not os.path.exists(args.tempPath):
+        os.makedirs(args.tempPath)
+
+    isOwnDownloader = downloader == None
+    if isOwnDownloader:
+        downloader = WebPageImageDownloader()
+    if hostScheduler == None:
+        hostScheduler = createHostScheduler(args)
+    downloader.hostScheduler = hostScheduler
+    downloader.fallbackMode = args.fallback
+    downloader.captureTimeOut = args.captureTimeOut
+    try:
+        fileUrls = downloader.downloadImagesFromWebPages(args.pages, args.tempPath, minDownloadSize, args.baseUrl, args.maxDepth, args.usePageUrl, args.timeOut, args.withFullArgUrl, args.maxImages, args.maxTime)
+        stats = dict(downloader.stats)
+        stats["hosts"] = downloader.getHostStats()
+    finally:
+        if isOwnDownloader:
+            downloader.close()
+            downloader = None
+
+    return fileUrls, stats
+
+
+# run a job with the parsed args and return the output path and the run statistics
+def runJob(args, downloader=None, hostScheduler=None):
+    startTime = time.time()
+
+    # --- download 
+    fileUrls, stats = downloadImages(args, downloader, hostScheduler)
+
+    stats["slides"] = createPresentation(args, fileUrls)
+    stats["elapsed"] = round(time.time() - startTime, 2)
+
+    return args.output, stats
+
+
+def printRunSummary(outputPath, stats):
+    print(f'Saved {outputPath}')
+    for key, value in stats.items():
+        if isinstance(value, dict):
+            print(f'  {key}:')
+            for subKey, subValue in value.items():
+                print(f'    {subKey}: {subValue}')
+        else:
+            print(f'  {key}: {value}')
+
+
+if __name__ == '__main__':
+    parser = createArgParser()
+    args = parser.parse_args()
+
+    outputPath, stats = runJob(args)
+    printRunSummary(outputPath, stats)
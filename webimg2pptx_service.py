@@ -0,0 +1,327 @@
+#   Copyright 2025 hidenorly
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import argparse
+import json
+import os
+import queue
+import shutil
+import sys
+import threading
+import time
+import uuid
+
+import urllib.error
+import urllib.request
+from urllib.parse import urlparse, parse_qs
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from HostScheduler import HostScheduler
+from webimg2pptx import WebPageImageDownloader, addHostSchedulerArgs, createArgParser, createHostScheduler, createPresentation, downloadImages
+
+
+class DownloaderPool:
+    def __init__(self, size=2):
+        self.size = size
+        self.created = 0
+        self.pool = queue.Queue()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        try:
+            return self.pool.get_nowait()
+        except queue.Empty:
+            pass
+        isCreate = False
+        with self.lock:
+            if self.created < self.size:
+                self.created = self.created + 1
+                isCreate = True
+        if isCreate:
+            try:
+                return WebPageImageDownloader()
+            except:
+                with self.lock:
+                    self.created = self.created - 1
+                raise
+        return self.pool.get()
+
+    def release(self, downloader, isBroken=False):
+        if isBroken:
+            downloader.close()
+            with self.lock:
+                self.created = self.created - 1
+        else:
+            self.pool.put(downloader)
+
+    def close(self):
+        while True:
+            try:
+                downloader = self.pool.get_nowait()
+            except queue.Empty:
+                break
+            downloader.close()
+            with self.lock:
+                self.created = self.created - 1
+
+
+class JobManager:
+    def __init__(self, workers=2, maxImages=0, maxTime=0, hostScheduler=None, retention=3600, keepTemp=False):
+        self.downloaderPool = DownloaderPool(workers)
+        # shared between jobs so that the per host limits are applied across the concurrent jobs
+        self.hostScheduler = hostScheduler if hostScheduler else HostScheduler()
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.maxImages = maxImages
+        self.maxTime = maxTime
+        # finished jobs are removed after the retention [sec]
+        self.retention = retention
+        self.keepTemp = keepTemp
+        self.jobs = {}
+        self.lock = threading.Lock()
+
+    # the server's limit is the upper bound of the job's limit. 0 means unlimited
+    def getLimit(self, jobLimit, serverLimit):
+        if jobLimit and serverLimit:
+            return min(jobLimit, serverLimit)
+        return jobLimit or serverLimit
+
+    def parseJobArgs(self, argv):
+        parser = createArgParser()
+        # return argparse's message to the client instead of printing it on the service's stderr
+        def raiseArgumentError(message):
+            raise ValueError(f'invalid job arguments: {message}')
+        parser.error = raiseArgumentError
+        try:
+            args = parser.parse_args(argv)
+        except SystemExit:
+            # e.g. --help
+            raise ValueError(f'invalid job arguments: {argv}')
+        args.maxImages = self.getLimit(args.maxImages, self.maxImages)
+        args.maxTime = self.getLimit(args.maxTime, self.maxTime)
+        args.output = os.path.abspath(args.output)
+        return args
+
+    def submit(self, argv):
+        args = self.parseJobArgs(argv)
+        jobId = uuid.uuid4().hex[0:12]
+        # each job has own temporary path to avoid filename collision with concurrent jobs
+        args.tempPath = os.path.abspath(os.path.join(args.tempPath, jobId))
+        job = {
+            "id": jobId,
+            "status": "queued",
+            "output": args.output,
+            "stats": None,
+            "error": None,
+            "submitted": time.time(),
+            "finished": None,
+        }
+        self.expireJobs()
+        with self.lock:
+            # concurrent jobs must not overwrite the other's deck e.g. with the default output.pptx
+            for _job, _done in self.jobs.values():
+                if _job["output"] == args.output and _job["status"] in ("queued", "running"):
+                    raise ValueError(f'{args.output} is the output of the queued or running job {_job["id"]}. Specify another -o')
+            self.jobs[jobId] = (job, threading.Event())
+        self.executor.submit(self._run, jobId, args)
+        return jobId
+
+    def _run(self, jobId, args):
+        job, done = self.jobs[jobId]
+        downloader = None
+        isBroken = False
+        try:
+            startTime = time.time()
+            downloader = self.downloaderPool.acquire()
+            job["status"] = "running"
+            try:
+                fileUrls, stats = downloadImages(args, downloader, self.hostScheduler)
+            except:
+                # the browser may be unusable. the other failures (e.g. output path) keep it warm
+                isBroken = True
+                raise
+            self.downloaderPool.release(downloader)
+            downloader = None
+            stats["slides"] = createPresentation(args, fileUrls)
+            stats["elapsed"] = round(time.time() - startTime, 2)
+            job["stats"] = stats
+            job["status"] = "done"
+        except Exception as e:
+            job["error"] = str(e)
+            job["status"] = "failed"
+        finally:
+            if downloader:
+                self.downloaderPool.release(downloader, isBroken)
+            if not self.keepTemp:
+                shutil.rmtree(args.tempPath, ignore_errors=True)
+            job["finished"] = time.time()
+            done.set()
+
+    def expireJobs(self):
+        now = time.time()
+        with self.lock:
+            for jobId in list(self.jobs.keys()):
+                finished = self.jobs[jobId][0]["finished"]
+                if finished and now - finished > self.retention:
+                    del self.jobs[jobId]
+
+    def getJob(self, jobId, wait=0):
+        self.expireJobs()
+        with self.lock:
+            entry = self.jobs.get(jobId)
+        if not entry:
+            return None
+        job, done = entry
+        if wait:
+            done.wait(wait)
+        return dict(job)
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        self.downloaderPool.close()
+
+
+class JobRequestHandler(BaseHTTPRequestHandler):
+    jobManager = None
+
+    def sendJson(self, status, data):
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    # POST /jobs {"args": [webimg2pptx.py's arguments]}
+    def do_POST(self):
+        if urlparse(self.path).path != "/jobs":
+            self.sendJson(404, {"error": "not found"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length) or b"{}")
+            jobId = self.jobManager.submit(list(map(str, request.get("args", []))))
+        except Exception as e:
+            self.sendJson(400, {"error": str(e)})
+            return
+        self.sendJson(202, {"id": jobId})
+
+    # GET /jobs/<id>?wait=<sec>
+    def do_GET(self):
+        parsedUrl = urlparse(self.path)
+        paths = parsedUrl.path.strip("/").split("/")
+        if len(paths) != 2 or paths[0] != "jobs":
+            self.sendJson(404, {"error": "not found"})
+            return
+        wait = 0
+        try:
+            wait = float(parse_qs(parsedUrl.query).get("wait", ["0"])[0])
+        except:
+            pass
+        job = self.jobManager.getJob(paths[1], wait)
+        if job:
+            self.sendJson(200, job)
+        else:
+            self.sendJson(404, {"error": f'job {paths[1]} is not found'})
+
+
+class JobClient:
+    def __init__(self, host="127.0.0.1", port=8765):
+        self.baseUrl = f'http://{host}:{port}'
+
+    def request(self, path, data=None, timeout=None):
+        body = None
+        headers = {}
+        if data != None:
+            body = json.dumps(data).encode("utf-8")
+            headers["Content-Type"] = "application/json"
+        req = urllib.request.Request(self.baseUrl+path, data=body, headers=headers)
+        try:
+            with urllib.request.urlopen(req, timeout=timeout) as response:
+                return json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            return json.loads(e.read())
+
+    def submit(self, argv):
+        return self.request("/jobs", {"args": argv}).get("id")
+
+    def wait(self, jobId, pollInterval=30):
+        while True:
+            job = self.request(f'/jobs/{jobId}?wait={pollInterval}', timeout=pollInterval+10)
+            if not job.get("status") in ("queued", "running"):
+                return job
+
+
+# resolve the relative output and temporary paths against the client's working directory
+def getAbsolutePathJobArgs(argv):
+    try:
+        args = createArgParser().parse_args(argv)
+    except SystemExit:
+        return argv
+    # the last one wins in argparse
+    return argv + ["--output", os.path.abspath(args.output), "--temp", os.path.abspath(args.tempPath)]
+
+
+def serve(host="127.0.0.1", port=8765, workers=2, maxImages=0, maxTime=0, hostScheduler=None, retention=3600, keepTemp=False):
+    jobManager = JobManager(workers, maxImages, maxTime, hostScheduler, retention, keepTemp)
+    JobRequestHandler.jobManager = jobManager
+    server = ThreadingHTTPServer((host, port), JobRequestHandler)
+    print(f'Serving on {host}:{port} with {workers} workers')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        jobManager.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run webimg2pptx as a service or submit a job to the service', formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('--host', type=str, default="127.0.0.1", help='Specify host to listen on / connect to')
+    parser.add_argument('--port', type=int, default=8765, help='Specify port to listen on / connect to')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    serveParser = subparsers.add_parser('serve', help='Run the service', formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    serveParser.add_argument('--workers', type=int, default=2, help='Specify number of concurrent jobs (=number of warm browsers)')
+    serveParser.add_argument('--maxImages', type=int, default=0, help='Specify maximum number of images per job (0: unlimited)')
+    serveParser.add_argument('--maxTime', type=int, default=0, help='Specify maximum download time [sec] per job (0: unlimited)')
+    serveParser.add_argument('--retention', type=int, default=3600, help='Specify time [sec] to keep the finished job results')
+    serveParser.add_argument('--keepTemp', action='store_true', default=False, help='Specify if want to keep the job\'s temporary path after the deck is saved')
+    addHostSchedulerArgs(serveParser)
+
+    submitParser = subparsers.add_parser('submit', help='Submit a job and wait for the result')
+    submitParser.add_argument('--noWait', action='store_true', default=False, help='Specify if want to return without waiting for the result')
+    submitParser.add_argument('jobArgs', nargs=argparse.REMAINDER, help='webimg2pptx.py arguments e.g. -- -o test.pptx https://hoge.com/')
+
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        serve(args.host, args.port, args.workers, args.maxImages, args.maxTime, createHostScheduler(args), args.retention, args.keepTemp)
+    else:
+        jobArgs = args.jobArgs
+        if jobArgs and jobArgs[0] == "--":
+            jobArgs = jobArgs[1:]
+        jobArgs = getAbsolutePathJobArgs(jobArgs)
+        client = JobClient(args.host, args.port)
+        jobId = client.submit(jobArgs)
+        if not jobId:
+            print(f'Failed to submit {jobArgs}')
+            sys.exit(1)
+        print(f'Submitted job {jobId}')
+        if not args.noWait:
+            job = client.wait(jobId)
+            print(json.dumps(job, indent=2))
+            if job.get("status") != "done":
+                sys.exit(1)